@@ -1,29 +1,63 @@
-from dagster import job, op
+from dagster import in_process_executor, job, op, resource
+import os
 import subprocess
+import urllib.request
+from pathlib import Path
+
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+SCRIPTS_DIR = Path(__file__).resolve().parent / "scripts"
+DBT_DIR = Path(__file__).resolve().parent / "telegram_dbt"
+
+def invalidate_api_cache(context):
+    """Ask the API to drop cached aggregates; a down API must not fail the run."""
+    req = urllib.request.Request(f"{API_URL}/api/admin/cache/invalidate", method="POST")
+    if os.getenv("ADMIN_TOKEN"):
+        req.add_header("X-Admin-Token", os.environ["ADMIN_TOKEN"])
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            context.log.info(f"API cache invalidated: {resp.read().decode()}")
+    except Exception as e:
+        context.log.warning(f"API cache invalidation failed: {e}")
+
+@resource
+def yolo_model(_init_context):
+    # Script modules are imported inside the ops/resources that need them, so
+    # loading this file (webserver, daemon) never pulls in torch/ultralytics.
+    from scripts import yolo_enrich
+    return yolo_enrich.get_model()
 
 @op
-def scrape_op(context):
+def scrape_op(context) -> dict:
+    from scripts.telegram_scraper import run as scrape_run
     context.log.info("Running scraper...")
-    subprocess.run(["python", "telegram_scraper.py", "--channels-file", "channels.txt", "--incremental"])
+    manifest = scrape_run(channels_file=str(SCRIPTS_DIR / "channels.txt"), incremental=True)
+    return manifest or {}
 
 @op
-def load_op(context):
+def load_op(context, manifest: dict) -> int:
+    from scripts.load_raw_to_postgres import run as load_run
     context.log.info("Loading to Postgres...")
-    subprocess.run(["python", "load_raw_to_postgres.py"])
+    return load_run()
 
-@op
-def dbt_op(context):
-    context.log.info("Running dbt models...")
-    subprocess.run(["dbt", "run"], check=False)
+@op(required_resource_keys={"yolo_model"})
+def yolo_op(context, manifest: dict) -> int:
+    from scripts import yolo_enrich
+    context.log.info("Running YOLO enrichment...")
+    return yolo_enrich.run(model=context.resources.yolo_model)
 
 @op
-def yolo_op(context):
-    context.log.info("Running YOLO enrichment...")
-    subprocess.run(["python", "yolo_enrich.py"])
+def dbt_op(context, loaded: int, detected: int):
+    # Runs last so fct/agg models include this run's messages and detections
+    context.log.info(f"Running dbt models ({loaded} new raw rows, {detected} detections)...")
+    subprocess.run(
+        ["dbt", "run", "--project-dir", str(DBT_DIR), "--profiles-dir", str(DBT_DIR)],
+        check=True,
+    )
+    invalidate_api_cache(context)
 
-@job
+# In-process: every step shares one interpreter, so imports and the YOLO
+# weights are loaded once per run instead of once per step process.
+@job(resource_defs={"yolo_model": yolo_model}, executor_def=in_process_executor)
 def telegram_pipeline():
-    scrape_op()
-    load_op()
-    dbt_op()
-    yolo_op()
+    manifest = scrape_op()
+    dbt_op(load_op(manifest), yolo_op(manifest))
@@ -0,0 +1,57 @@
+# fastapi_app/cache.py
+import functools
+import hashlib
+import json
+import logging
+
+from fastapi.encoders import jsonable_encoder
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_key(prefix: str, params: dict) -> str:
+    raw = json.dumps(sorted(params.items()), default=str)
+    return f"{prefix}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def cached(prefix: str, ttl: int):
+    """
+    Cache an endpoint's JSON-encoded result in Redis for `ttl` seconds.
+    Falls through to the handler when Redis is not configured or unavailable.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            redis = db.REDIS
+            if redis is None:
+                return await func(*args, **kwargs)
+
+            key = _cache_key(prefix, kwargs)
+            try:
+                hit = await redis.get(key)
+                if hit is not None:
+                    return json.loads(hit)
+            except Exception as e:
+                logger.warning("Cache read failed for %s: %s", key, e)
+
+            result = await func(*args, **kwargs)
+            try:
+                await redis.set(key, json.dumps(jsonable_encoder(result)), ex=ttl)
+            except Exception as e:
+                logger.warning("Cache write failed for %s: %s", key, e)
+            return result
+        return wrapper
+    return decorator
+
+
+async def delete_pattern(pattern: str) -> int:
+    """Delete every key matching `pattern`; returns the number removed."""
+    redis = db.REDIS
+    if redis is None:
+        return 0
+    deleted = 0
+    async for key in redis.scan_iter(match=pattern, count=500):
+        deleted += await redis.delete(key)
+    return deleted
@@ -2,6 +2,8 @@
 import os
 import asyncio
 import asyncpg
+import orjson
+import redis.asyncio as aioredis
 from typing import Optional
 from dotenv import load_dotenv
 
@@ -9,6 +11,18 @@ from dotenv import load_dotenv
 load_dotenv()
 
 POOL: Optional[asyncpg.pool.Pool] = None
+REDIS: Optional[aioredis.Redis] = None
+
+
+async def _init_conn(conn):
+    """Decode jsonb with orjson over the binary protocol (version byte 0x01 + JSON text)."""
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda v: b"\x01" + orjson.dumps(v),
+        decoder=lambda v: orjson.loads(v[1:]),
+        schema="pg_catalog",
+        format="binary",
+    )
 
 
 async def init_db_pool():
@@ -33,10 +47,18 @@ async def init_db_pool():
     if missing:
         raise RuntimeError(f"Missing DB environment variables: {missing}")
 
+    # Size max to roughly (DB host cores * 2) + 1; keep min (default max/2) warm
+    # to avoid connect latency on traffic bursts. asyncpg rejects min > max.
+    max_size = int(os.getenv("PGPOOL_MAX", 40))
+    min_size = min(int(os.getenv("PGPOOL_MIN", max_size // 2)), max_size)
     POOL = await asyncpg.create_pool(
         **PG,
-        min_size=1,
-        max_size=10,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=float(os.getenv("PGPOOL_MAX_INACTIVE_LIFETIME", 300)),
+        statement_cache_size=int(os.getenv("PG_STATEMENT_CACHE_SIZE", 1024)),
+        command_timeout=float(os.getenv("PG_COMMAND_TIMEOUT", 30)),
+        init=_init_conn,
     )
     return POOL
 
@@ -47,3 +69,28 @@ async def close_db_pool():
     if POOL:
         await POOL.close()
         POOL = None
+
+
+async def init_redis():
+    """
+    Initialize the Redis client used for response caching.
+    Caching is disabled when REDIS_URL is not set.
+    """
+    global REDIS
+    if REDIS:
+        return REDIS
+
+    url = os.getenv("REDIS_URL")
+    if not url:
+        return None
+
+    REDIS = aioredis.from_url(url, max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 20)))
+    return REDIS
+
+
+async def close_redis():
+    """Close the Redis client on FastAPI shutdown."""
+    global REDIS
+    if REDIS:
+        await REDIS.aclose()
+        REDIS = None
@@ -1,16 +1,26 @@
 # fastapi_app/main.py
+import base64
+import json
 import os
-from fastapi import FastAPI, HTTPException, Query, Depends
+import secrets
+from datetime import datetime
+from fastapi import FastAPI, HTTPException, Query, Depends, Header, Response
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import asyncio
 
 from . import db
+from .cache import cached, delete_pattern
 from .schemas import MessageRow, DetectionRow, MessageWithObject, ChannelActivityItem, TopObjectItem
 
 ANALYTICS_SCHEMA = os.getenv("ANALYTICS_SCHEMA", "analytics")  # default schema where dbt created models
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 3600))  # aggregates only change after a pipeline run
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+CACHED_PREFIXES = ("top_objects", "channel_activity")
 
-app = FastAPI(title="Telegram Analytical API", version="1.0")
+# orjson encodes large row lists far faster than the stdlib encoder
+app = FastAPI(title="Telegram Analytical API", version="1.0", default_response_class=ORJSONResponse)
 
 # Allow CORS in development; adjust origins in production
 app.add_middleware(
@@ -19,15 +29,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 @app.on_event("startup")
 async def startup():
     await db.init_db_pool()
+    await db.init_redis()
 
 @app.on_event("shutdown")
 async def shutdown():
     await db.close_db_pool()
+    await db.close_redis()
 
 # Dependency helper to get a connection from the pool
 async def get_conn():
@@ -35,31 +48,54 @@ async def get_conn():
     async with pool.acquire() as conn:
         yield conn
 
+# Cached endpoints borrow a connection only on a cache miss (the @cached wrapper
+# runs before the handler body), so hits never wait on the pool.
+async def fetch_uncached(sql, *args):
+    pool = await db.init_db_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetch(sql, *args)
+
+# Handlers return plain row dicts: response_model still validates and documents the
+# output, but each row is no longer built into a model twice.
+
 # -------------------------
 # 1) Search messages (keyword)
 # -------------------------
+# SQL is built once at import so asyncpg's per-connection statement cache
+# (keyed on the exact query string) reuses the server-side prepared statement.
+SEARCH_SQL = f"""
+    select channel, message_id, message_text, message_date, views, has_media
+    from {ANALYTICS_SCHEMA}.fct_messages
+    where lower(message_text) like lower($1)
+    order by message_date desc
+    limit $2
+"""
+
 @app.get("/api/search", response_model=List[MessageRow])
 async def search_messages(q: str = Query(..., min_length=2), limit: int = Query(50, ge=1, le=1000), conn=Depends(get_conn)):
     """
     Search messages text for a keyword (case-insensitive).
     """
-    sql = f"""
-        select channel, message_id, message_text, message_date, views, has_media
-        from {ANALYTICS_SCHEMA}.fct_messages
-        where message_text ilike $1
-        order by message_date desc
-        limit $2
-    """
     pattern = f"%{q}%"
     try:
-        rows = await conn.fetch(sql, pattern, limit)
-        return [MessageRow(**dict(r)) for r in rows]
+        rows = await conn.fetch(SEARCH_SQL, pattern, limit)
+        return [dict(r) for r in rows]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # -------------------------
 # 2) Detections / YOLO results
 # -------------------------
+# Only the WHERE clause varies; the handful of filter combinations each map to
+# one stable string, so they stay cache hits as well.
+DETECTIONS_SQL = f"""
+    select channel, message_id, image_path, object, confidence
+    from {ANALYTICS_SCHEMA}.fct_image_detections
+    {{where_sql}}
+    order by confidence desc
+    limit ${{limit_idx}}
+"""
+
 @app.get("/api/detections", response_model=List[DetectionRow])
 async def get_detections(channel: Optional[str] = None, object_name: Optional[str] = None,
                          min_confidence: float = 0.0, limit: int = 100, conn=Depends(get_conn)):
@@ -72,102 +108,185 @@ async def get_detections(channel: Optional[str] = None, object_name: Optional[st
     if channel:
         where_clauses.append(f"channel = ${idx}"); params.append(channel); idx += 1
     if object_name:
-        where_clauses.append(f"object ilike ${idx}"); params.append(f"%{object_name}%"); idx += 1
+        where_clauses.append(f"lower(object) like lower(${idx})"); params.append(f"%{object_name}%"); idx += 1
     if min_confidence and min_confidence > 0:
         where_clauses.append(f"confidence >= ${idx}"); params.append(min_confidence); idx += 1
 
     where_sql = (" where " + " and ".join(where_clauses)) if where_clauses else ""
-    sql = f"""
-        select channel, message_id, image_path, object, confidence
-        from {ANALYTICS_SCHEMA}.fct_image_detections
-        {where_sql}
-        order by confidence desc
-        limit ${idx}
-    """
+    sql = DETECTIONS_SQL.format(where_sql=where_sql, limit_idx=idx)
     params.append(limit)
     try:
         rows = await conn.fetch(sql, *params)
-        return [DetectionRow(**dict(r)) for r in rows]
+        return [dict(r) for r in rows]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # -------------------------
 # 3) Channel activity
 # -------------------------
+# Reads the daily buckets dbt precomputes in agg_channel_daily
+CHANNEL_ACTIVITY_SQL = f"""
+    select to_char(day, 'YYYY-MM-DD') as day, messages
+    from {ANALYTICS_SCHEMA}.agg_channel_daily
+    where channel = $1 and day >= (now() - ($2 * interval '1 day'))::date
+    order by day
+"""
+
 @app.get("/api/channel-activity/{channel}", response_model=List[ChannelActivityItem])
-async def channel_activity(channel: str, days: int = Query(90, ge=1, le=365), conn=Depends(get_conn)):
+@cached("channel_activity", ttl=CACHE_TTL_SECONDS)
+async def channel_activity(channel: str, days: int = Query(90, ge=1, le=365)):
     """
     Returns daily message counts for the channel for the last `days` days.
     """
-    sql = f"""
-        select to_char(day, 'YYYY-MM-DD') as day, cnt from (
-            select date_trunc('day', message_date) as day, count(*) as cnt
-            from {ANALYTICS_SCHEMA}.fct_messages
-            where channel = $1 and message_date >= now() - ($2 * interval '1 day')
-            group by day
-            order by day
-        ) t;
-    """
     try:
-        rows = await conn.fetch(sql, channel, days)
-        return [ChannelActivityItem(day=r["day"], messages=r["cnt"]) for r in rows]
+        rows = await fetch_uncached(CHANNEL_ACTIVITY_SQL, channel, days)
+        return [dict(r) for r in rows]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # -------------------------
 # 4) Top objects detected (aggregated)
 # -------------------------
+# Reads the counts dbt precomputes in agg_top_objects
+TOP_OBJECTS_SQL = f"""
+    select object, mentions
+    from {ANALYTICS_SCHEMA}.agg_top_objects
+    order by mentions desc
+    limit $1
+"""
+
 @app.get("/api/top-objects", response_model=List[TopObjectItem])
-async def top_objects(limit: int = Query(20, ge=1, le=200), conn=Depends(get_conn)):
+@cached("top_objects", ttl=CACHE_TTL_SECONDS)
+async def top_objects(limit: int = Query(20, ge=1, le=200)):
     """
     Returns most frequently detected objects across images.
     """
-    sql = f"""
-        select object, count(*) as mentions
-        from {ANALYTICS_SCHEMA}.fct_image_detections
-        group by object
-        order by mentions desc
-        limit $1
-    """
     try:
-        rows = await conn.fetch(sql, limit)
-        return [TopObjectItem(object=r["object"], mentions=r["mentions"]) for r in rows]
+        rows = await fetch_uncached(TOP_OBJECTS_SQL, limit)
+        return [dict(r) for r in rows]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # -------------------------
 # 5) Messages with objects joined query (paginated)
 # -------------------------
+# Keyset pagination pages by message: the key is (message_date, channel, message_id),
+# which is unique per message, and each message carries all its detections onto
+# the same page, so per-object rows can never straddle a page boundary. NULL dates
+# sort last and are paged as a separate segment, so both segments keep a plain row
+# comparison that the idx_fct_messages_keyset* indexes can serve.
+MESSAGES_PAGE_SQL = f"""
+    with page as (
+        select m.channel, m.message_id, m.message_text, m.message_date
+        from {ANALYTICS_SCHEMA}.messages_with_objects m
+        where {{where_sql}}
+        order by m.message_date desc, m.channel desc, m.message_id desc
+        limit ${{limit_idx}}
+    )
+    select p.channel, p.message_id, p.message_text, p.message_date, d.object, d.confidence
+    from page p
+    left join {ANALYTICS_SCHEMA}.fct_image_detections d
+      on p.channel = d.channel and p.message_id = d.message_id{{object_join_sql}}
+    order by p.message_date desc nulls last, p.channel desc, p.message_id desc, d.confidence desc nulls last
+"""
+
+
+def _messages_page_query(dated: bool, channel: Optional[str], object_name: Optional[str],
+                         after: Optional[list], limit: int):
+    """Build the page query for the dated (dated=True) or NULL-date segment."""
+    where_clauses = ["m.message_date is not null" if dated else "m.message_date is null"]
+    params = []
+    object_join_sql = ""
+    if channel:
+        params.append(channel)
+        where_clauses.append(f"m.channel = ${len(params)}")
+    if object_name:
+        params.append(f"%{object_name}%")
+        where_clauses.append(
+            f"exists (select 1 from {ANALYTICS_SCHEMA}.fct_image_detections x"
+            f" where x.channel = m.channel and x.message_id = m.message_id"
+            f" and lower(x.object) like lower(${len(params)}))"
+        )
+        object_join_sql = f" and lower(d.object) like lower(${len(params)})"
+    if after:
+        message_date, after_channel, after_id = after
+        if dated:
+            params.extend([message_date, after_channel, after_id])
+            where_clauses.append(f"(m.message_date, m.channel, m.message_id) < (${len(params) - 2}, ${len(params) - 1}, ${len(params)})")
+        else:
+            params.extend([after_channel, after_id])
+            where_clauses.append(f"(m.channel, m.message_id) < (${len(params) - 1}, ${len(params)})")
+    params.append(limit)
+    sql = MESSAGES_PAGE_SQL.format(where_sql=" and ".join(where_clauses),
+                                   object_join_sql=object_join_sql, limit_idx=len(params))
+    return sql, params
+
+
+def _message_count(rows) -> int:
+    return len({(r["channel"], r["message_id"]) for r in rows})
+
+
+def _encode_cursor(row) -> str:
+    message_date = row["message_date"].isoformat() if row["message_date"] else None
+    key = [message_date, row["channel"], row["message_id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        message_date, channel, message_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return [datetime.fromisoformat(message_date) if message_date else None, channel, int(message_id)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/api/messages-with-objects", response_model=List[MessageWithObject])
-async def messages_with_objects(channel: Optional[str] = None,
+async def messages_with_objects(response: Response,
+                                channel: Optional[str] = None,
                                 object_name: Optional[str] = None,
                                 limit: int = Query(50, ge=1, le=1000),
-                                offset: int = Query(0, ge=0),
+                                cursor: Optional[str] = None,
                                 conn=Depends(get_conn)):
     """
-    Return messages joined to detected objects (if any). Pagination via limit/offset.
+    Return messages joined to detected objects (if any). `limit` counts messages;
+    each message comes with all of its detections. Pagination via keyset cursor:
+    pass the `X-Next-Cursor` response header back as `cursor` to get the next page.
     """
-    where_clauses = []
-    params = []
-    idx = 1
-    if channel:
-        where_clauses.append(f"m.channel = ${idx}"); params.append(channel); idx += 1
-    if object_name:
-        where_clauses.append(f"d.object ilike ${idx}"); params.append(f"%{object_name}%"); idx += 1
+    after = _decode_cursor(cursor) if cursor else None
+    try:
+        rows = []
+        in_dated_segment = after is None or after[0] is not None
+        if in_dated_segment:
+            sql, params = _messages_page_query(True, channel, object_name, after, limit)
+            rows = list(await conn.fetch(sql, *params))
+        remaining = limit - _message_count(rows)
+        if remaining > 0:
+            # Dated messages ran out (or the cursor is already past them): fill up from the NULL-date tail
+            sql, params = _messages_page_query(False, channel, object_name,
+                                               None if in_dated_segment else after, remaining)
+            rows.extend(await conn.fetch(sql, *params))
+        if rows and _message_count(rows) == limit:
+            response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
+        return [dict(r) for r in rows]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-    where_sql = (" where " + " and ".join(where_clauses)) if where_clauses else ""
-    sql = f"""
-        select m.channel, m.message_id, m.message_text, m.message_date, d.object, d.confidence
-        from {ANALYTICS_SCHEMA}.messages_with_objects m
-        left join {ANALYTICS_SCHEMA}.fct_image_detections d
-          on m.channel = d.channel and m.message_id = d.message_id
-        {where_sql}
-        order by m.message_date desc
-        limit ${idx} offset ${idx + 1}
+# -------------------------
+# 6) Admin: drop cached aggregates (called by the pipeline after a run)
+# -------------------------
+@app.post("/api/admin/cache/invalidate")
+async def invalidate_cache(x_admin_token: Optional[str] = Header(None)):
     """
-    params.extend([limit, offset])
+    Delete cached responses for the aggregate endpoints.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled: ADMIN_TOKEN is not set")
+    if not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
     try:
-        rows = await conn.fetch(sql, *params)
-        return [MessageWithObject(**dict(r)) for r in rows]
+        deleted = 0
+        for prefix in CACHED_PREFIXES:
+            deleted += await delete_pattern(f"{prefix}:*")
+        return {"deleted": deleted}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
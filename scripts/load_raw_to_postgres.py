@@ -1,72 +1,134 @@
 #!/usr/bin/env python3
 import argparse
-import json
+import asyncio
 import os
+from datetime import datetime
 from pathlib import Path
-import psycopg2
-from psycopg2.extras import Json
+import asyncpg
+import orjson
+import pyarrow.parquet as pq
 
-def get_conn():
-    import os
-    return psycopg2.connect(
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SOURCE = PROJECT_ROOT / "data" / "raw" / "telegram_messages"
+
+COLUMNS = ["channel", "message_id", "message_date", "raw"]
+
+async def get_conn():
+    return await asyncpg.connect(
         host=os.getenv("POSTGRES_HOST","localhost"),
-        dbname=os.getenv("POSTGRES_DB","postgres"),
+        database=os.getenv("POSTGRES_DB","postgres"),
         user=os.getenv("POSTGRES_USER","postgres"),
         password=os.getenv("POSTGRES_PASSWORD","root"),
         port=int(os.getenv("POSTGRES_PORT","5432"))
     )
 
 print("Db Connect succesfull")
-def ensure_table(conn):
-    with conn.cursor() as cur:
-        cur.execute("""
-        CREATE SCHEMA IF NOT EXISTS raw;
-        CREATE TABLE IF NOT EXISTS raw.telegram_messages (
-            id serial PRIMARY KEY,
-            channel text,
-            message_id int,
-            message_date timestamptz,
-            raw jsonb
-        );
-        """)
-        conn.commit()
+async def ensure_table(conn):
+    await conn.execute("""
+    CREATE SCHEMA IF NOT EXISTS raw;
+    CREATE TABLE IF NOT EXISTS raw.telegram_messages (
+        id serial PRIMARY KEY,
+        channel text,
+        message_id int,
+        message_date timestamptz,
+        raw jsonb
+    );
+    -- Earlier loads re-inserted every file, so drop duplicates once before
+    -- the unique index that ON CONFLICT relies on can be built.
+    DO $$
+    BEGIN
+        IF to_regclass('raw.idx_telegram_messages_unique') IS NULL THEN
+            DELETE FROM raw.telegram_messages a
+              USING raw.telegram_messages b
+             WHERE a.channel = b.channel AND a.message_id = b.message_id AND a.id > b.id;
+        END IF;
+    END $$;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_telegram_messages_unique
+      ON raw.telegram_messages(channel, message_id);
+    """)
 
-def ingest_file(conn, channel, file_path):
-    with open(file_path, "r", encoding="utf-8") as fh:
-        rows = []
+def parse_date(value):
+    """Binary COPY needs a real datetime, not the ISO string the scraper writes."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def iter_parquet_rows(file_path):
+    """Yield COPY records from a scraper Parquet shard, one row group at a time."""
+    for batch in pq.ParquetFile(file_path).iter_batches(columns=["channel", "id", "date", "raw"]):
+        cols = batch.to_pydict()
+        for channel, message_id, message_date, raw in zip(cols["channel"], cols["id"], cols["date"], cols["raw"]):
+            yield (channel, message_id, parse_date(message_date), raw)
+
+def iter_rows(channel, file_path):
+    """Yield COPY records one line at a time from a legacy JSONL day file."""
+    with open(file_path, "rb") as fh:
         for ln in fh:
             try:
-                obj = json.loads(ln)
-                message_id = obj.get("id")
-                message_date = obj.get("date")
-                rows.append((channel, message_id, message_date, Json(obj)))
+                obj = orjson.loads(ln)
+                # the line is already valid JSON; send it as-is rather than re-encoding
+                yield (channel, obj.get("id"), parse_date(obj.get("date")), ln.decode("utf-8").strip())
             except Exception:
                 continue
-    if not rows:
-        return 0
-    with conn.cursor() as cur:
-        cur.executemany("INSERT INTO raw.telegram_messages (channel, message_id, message_date, raw) VALUES (%s,%s,%s,%s) ON CONFLICT DO NOTHING", rows)
-        conn.commit()
-        return len(rows)
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--source", default="data/raw/telegram_messages")
-    args = parser.parse_args()
-    src = Path(args.source)
-    conn = get_conn()
-    ensure_table(conn)
+async def ingest_file(conn, records):
+    """
+    COPY the records into a temp stage table, then INSERT ... SELECT so
+    ON CONFLICT DO NOTHING still applies against raw.telegram_messages.
+    """
+    async with conn.transaction():
+        await conn.execute("""
+        CREATE TEMP TABLE stage (
+            channel text,
+            message_id int,
+            message_date timestamptz,
+            raw jsonb
+        ) ON COMMIT DROP
+        """)
+        await conn.copy_records_to_table(
+            "stage", records=records, columns=COLUMNS
+        )
+        status = await conn.execute("""
+        INSERT INTO raw.telegram_messages (channel, message_id, message_date, raw)
+        SELECT channel, message_id, message_date, raw FROM stage
+        ON CONFLICT (channel, message_id) DO NOTHING
+        """)
+    # status looks like "INSERT 0 <n>"
+    return int(status.split()[-1])
+
+async def ingest_all(source):
+    src = Path(source)
+    conn = await get_conn()
+    await ensure_table(conn)
     total = 0
     for day_dir in src.iterdir():
         if not day_dir.is_dir():
             continue
+        for file in day_dir.glob("*.parquet"):
+            n = await ingest_file(conn, iter_parquet_rows(file))
+            total += n
+            print(f"Inserted {n} rows from {file}")
         for file in day_dir.glob("*.json"):
             channel_name = file.stem
-            n = ingest_file(conn, channel_name, file)
+            n = await ingest_file(conn, iter_rows(channel_name, file))
             total += n
             print(f"Inserted {n} rows from {file}")
     print("Total inserted:", total)
-    conn.close()
+    await conn.close()
+    return total
+
+def run(source=DEFAULT_SOURCE):
+    """Load every day file under `source`; returns the number of rows inserted."""
+    return asyncio.run(ingest_all(source))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default=str(DEFAULT_SOURCE))
+    args = parser.parse_args()
+    run(args.source)
 
 if __name__ == "__main__":
     main()
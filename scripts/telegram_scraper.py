@@ -13,12 +13,16 @@ import json
 import logging
 import os
 import re
+import sqlite3
 import sys
 from datetime import datetime, timezone, date
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from typing import Optional, Set
 
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 from telethon import TelegramClient, errors
 from telethon.tl.types import Message
 
@@ -32,13 +36,14 @@ except Exception:
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 API_ID = int(os.environ.get("TELEGRAM_API_ID", "0") or 0)
 API_HASH = os.environ.get("TELEGRAM_API_HASH", "")
-SESSION_NAME = os.environ.get("TELEGRAM_SESSION", "scraper.session")
+SESSION_NAME = os.environ.get("TELEGRAM_SESSION", str(Path(__file__).resolve().parent / "scraper.session"))
 
 BASE_DIR = PROJECT_ROOT / "data" / "raw"
 MSG_DIR = BASE_DIR / "telegram_messages"
 IMG_DIR = BASE_DIR / "images"
 MANIFEST_DIR = MSG_DIR / "_manifests"
 LOG_DIR = PROJECT_ROOT / "logs"
+SHARD_BYTES = 64 * 1024 * 1024  # serialized bytes buffered before a Parquet shard is written
 
 """BASE_DIR = Path("data/raw")
 MSG_DIR = BASE_DIR / "telegram_messages"
@@ -123,21 +128,33 @@ async def download_with_retries(client, message, dest_path: Path, max_retries: i
     return None
 
 
-def load_seen_ids(channel: str) -> Set[int]:
-    """Return set of already-saved message IDs for channel."""
+def scan_saved_ids(channel: str) -> Set[int]:
+    """Return set of already-saved message IDs for channel by re-reading every day file."""
     seen = set()
     sanitized = sanitize_filename(channel)
     for day_dir in MSG_DIR.iterdir():
         if not day_dir.is_dir():
             continue
+        # The glob also matches channels whose sanitized name merely starts with
+        # ours (e.g. "foo" vs "foo-bar"), so keep only this channel's rows.
+        for shard in day_dir.glob(f"{sanitized}-*.parquet"):
+            try:
+                table = pq.read_table(shard, columns=["channel", "id"])
+            except Exception:
+                continue
+            seen.update(
+                i for c, i in zip(table.column("channel").to_pylist(), table.column("id").to_pylist())
+                if c == sanitized and i is not None
+            )
+        # JSONL day files written before the switch to Parquet
         file_path = day_dir / f"{sanitized}.json"
         if not file_path.exists():
             continue
         try:
-            with open(file_path, "r", encoding="utf-8") as fh:
+            with open(file_path, "rb") as fh:
                 for line in fh:
                     try:
-                        obj = json.loads(line)
+                        obj = orjson.loads(line)
                         if isinstance(obj.get("id"), int):
                             seen.add(obj["id"])
                     except Exception:
@@ -147,62 +164,158 @@ def load_seen_ids(channel: str) -> Set[int]:
     return seen
 
 
+def open_seen_index(channel: str) -> sqlite3.Connection:
+    """
+    Open the per-channel SQLite index of saved message IDs.
+    Built from the saved day files once; afterwards scrape_channel keeps it current.
+    """
+    path = MANIFEST_DIR / f"{sanitize_filename(channel)}.sqlite"
+    conn = sqlite3.connect(path, isolation_level=None)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'seen'"
+    ).fetchone()
+    if not exists:
+        conn.execute("BEGIN")
+        conn.execute("CREATE TABLE seen(id INTEGER PRIMARY KEY)")
+        record_seen_ids(conn, scan_saved_ids(channel), begin=False)
+        conn.execute("COMMIT")
+    return conn
+
+
+def record_seen_ids(conn: sqlite3.Connection, ids, begin: bool = True):
+    if begin:
+        conn.execute("BEGIN")
+    conn.executemany("INSERT OR IGNORE INTO seen(id) VALUES (?)", ((i,) for i in ids))
+    if begin:
+        conn.execute("COMMIT")
+
+
+# channel string -> resolved input entity; survives FloodWait retries of scrape_channel
+_ENTITY_CACHE = {}
+
+
+async def resolve_entity(client: TelegramClient, channel: str):
+    """Resolve the channel username once and reuse it for every iter_messages call."""
+    entity = _ENTITY_CACHE.get(channel)
+    if entity is None:
+        entity = await client.get_input_entity(channel)
+        _ENTITY_CACHE[channel] = entity
+    return entity
+
+
+def load_seen_ids(conn: sqlite3.Connection) -> Set[int]:
+    """Return set of already-saved message IDs from the channel's index."""
+    return {row[0] for row in conn.execute("SELECT id FROM seen")}
+
+
+class ShardBuffer:
+    """
+    Buffers one channel's serialized messages for the current day and writes
+    them as a zstd-compressed Parquet shard (MSG_DIR/<day>/<channel>-<ts>.parquet).
+    Messages arrive newest first, so a day change means the previous day is done.
+    """
+
+    def __init__(self, sanitized: str, index: sqlite3.Connection):
+        self.sanitized = sanitized
+        self.index = index
+        self.date_str = None
+        self._reset()
+
+    def _reset(self):
+        self.ids, self.dates, self.raws = [], [], []
+        self.nbytes = 0
+
+    def add(self, date_str: str, serial: dict):
+        if self.date_str is not None and date_str != self.date_str:
+            self.flush()
+        self.date_str = date_str
+        raw = orjson.dumps(serial, default=str).decode()
+        self.ids.append(serial.get("id"))
+        self.dates.append(serial.get("date"))
+        self.raws.append(raw)
+        self.nbytes += len(raw)
+        if self.nbytes >= SHARD_BYTES:
+            self.flush()
+
+    def flush(self):
+        if not self.ids:
+            return
+        file_dir = MSG_DIR / self.date_str
+        ensure_path(file_dir)
+        path = file_dir / f"{self.sanitized}-{datetime.utcnow():%Y%m%dT%H%M%S%f}.parquet"
+        table = pa.table({
+            "channel": pa.array([self.sanitized] * len(self.ids), pa.string()),
+            "id": pa.array(self.ids, pa.int64()),
+            "date": pa.array(self.dates, pa.string()),
+            "raw": pa.array(self.raws, pa.string()),
+        })
+        # Write-then-rename so readers never see a shard without its footer
+        tmp = path.with_name(path.name + ".tmp")
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, path)
+        # Only list IDs in the index once their shard is complete on disk
+        record_seen_ids(self.index, self.ids)
+        logger.info("Wrote %d messages to %s", len(self.ids), path)
+        self._reset()
+
+
 async def scrape_channel(client: TelegramClient, channel: str, limit=None,
                          incremental=False, since: Optional[date] = None,
                          until: Optional[date] = None):
     sanitized = sanitize_filename(channel)
     ensure_path(IMG_DIR / sanitized)
-    seen_ids = load_seen_ids(channel) if incremental else set()
+    entity = await resolve_entity(client, channel)
+    index = open_seen_index(channel)
+    seen_ids = load_seen_ids(index) if incremental else set()
     count = 0
-    async for msg in client.iter_messages(channel, limit=limit):
-        if msg is None or msg.id in seen_ids:
-            continue
-
-        msg_date = msg.date.date() if msg.date else date.today()
-        # Apply date filters
-        if since and msg_date < since:
-            break
-        if until and msg_date >= until:
-            continue
-
-        date_str = msg_date.isoformat()
-        file_dir = MSG_DIR / date_str
-        ensure_path(file_dir)
-        file_path = file_dir / f"{sanitized}.json"
-
-        serial = message_to_serializable(msg)
-        with open(file_path, "a", encoding="utf-8") as fh:
-            fh.write(json.dumps(serial, ensure_ascii=False, default=str) + "\n")
-
-        # Check if media is image
-        is_image = False
-        if getattr(msg, "photo", None):
-            is_image = True
-        elif getattr(msg, "document", None):
-            mime = getattr(msg.document, "mime_type", "") or ""
-            if mime.startswith("image"):
+    shards = ShardBuffer(sanitized, index)
+    try:
+        async for msg in client.iter_messages(entity, limit=limit):
+            if msg is None or msg.id in seen_ids:
+                continue
+
+            msg_date = msg.date.date() if msg.date else date.today()
+            # Apply date filters
+            if since and msg_date < since:
+                break
+            if until and msg_date >= until:
+                continue
+
+            date_str = msg_date.isoformat()
+            shards.add(date_str, message_to_serializable(msg))
+
+            # Check if media is image
+            is_image = False
+            if getattr(msg, "photo", None):
                 is_image = True
-
-        if is_image:
-            ext = ".jpg"
-            orig = getattr(getattr(msg, "document", None), "file_name", None)
-            if orig and "." in orig:
-                ext = Path(orig).suffix
-            fname = f"{sanitized}_{msg.id}_{date_str}{ext}"
-            dest = IMG_DIR / sanitized / fname
-            i = 1
-            while dest.exists():
-                dest = IMG_DIR / sanitized / f"{Path(fname).stem}_{i}{ext}"
-                i += 1
-            downloaded = await download_with_retries(client, msg, dest)
-            if downloaded:
-                logger.info("Downloaded image: %s", downloaded)
-            else:
-                logger.warning("Failed to download image for msg %s", msg.id)
-
-        count += 1
-        if count % 50 == 0:
-            await asyncio.sleep(0.3)
+            elif getattr(msg, "document", None):
+                mime = getattr(msg.document, "mime_type", "") or ""
+                if mime.startswith("image"):
+                    is_image = True
+
+            if is_image:
+                ext = ".jpg"
+                orig = getattr(getattr(msg, "document", None), "file_name", None)
+                if orig and "." in orig:
+                    ext = Path(orig).suffix
+                fname = f"{sanitized}_{msg.id}_{date_str}{ext}"
+                dest = IMG_DIR / sanitized / fname
+                i = 1
+                while dest.exists():
+                    dest = IMG_DIR / sanitized / f"{Path(fname).stem}_{i}{ext}"
+                    i += 1
+                downloaded = await download_with_retries(client, msg, dest)
+                if downloaded:
+                    logger.info("Downloaded image: %s", downloaded)
+                else:
+                    logger.warning("Failed to download image for msg %s", msg.id)
+
+            count += 1
+            if count % 50 == 0:
+                await asyncio.sleep(0.3)
+    finally:
+        shards.flush()
+        index.close()
 
     logger.info("Finished %s (saved %d messages)", channel, count)
     return count
@@ -211,7 +324,7 @@ async def scrape_channel(client: TelegramClient, channel: str, limit=None,
 async def main(args):
     if not API_ID or not API_HASH:
         logger.error("Set TELEGRAM_API_ID and TELEGRAM_API_HASH in environment")
-        sys.exit(1)
+        raise RuntimeError("Missing Telegram API credentials")
 
     # Parse dates
     since_date = datetime.strptime(args.since, "%Y-%m-%d").date() if args.since else None
@@ -221,61 +334,87 @@ async def main(args):
     await client.start()
     logger.info("Connected to Telegram")
 
-    # Read channels
-    channels = []
-    if args.channels_file and os.path.exists(args.channels_file):
-        with open(args.channels_file, "r", encoding="utf-8") as fh:
-            for ln in fh:
-                ln = ln.strip()
-                if ln and not ln.startswith("#"):
-                    channels.append(ln)
-    if args.channels:
-        channels.extend(args.channels)
-    channels = list(dict.fromkeys(channels))
-    if not channels:
-        logger.error("No channels provided")
-        return
-
-    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    manifest = {
-        "run_id": run_id,
-        "channels": channels,
-        "limit": args.limit,
-        "incremental": args.incremental,
-        "since": args.since,
-        "until": args.until,
-        "started_at": datetime.utcnow().isoformat() + "Z",
-        "results": {},
-    }
-
-    for ch in channels:
-        try:
-            processed = await scrape_channel(
-                client, ch, limit=args.limit, incremental=args.incremental,
-                since=since_date, until=until_date
-            )
-            manifest["results"][ch] = {"processed": processed, "status": "ok"}
-        except errors.FloodWaitError as fw:
-            wait = int(getattr(fw, "seconds", 60)) + 1
-            logger.warning("FloodWait: sleeping %s s", wait)
-            await asyncio.sleep(wait)
-            processed = await scrape_channel(
-                client, ch, limit=args.limit, incremental=args.incremental,
-                since=since_date, until=until_date
-            )
-            manifest["results"][ch] = {"processed": processed, "status": "ok_after_wait"}
-        except Exception as e:
-            logger.exception("Error scraping %s: %s", ch, e)
-            manifest["results"][ch] = {"processed": 0, "status": f"error:{e}"}
-
-    manifest["finished_at"] = datetime.utcnow().isoformat() + "Z"
-    out = MANIFEST_DIR / f"{run_id}.json"
-    with open(out, "w", encoding="utf-8") as fh:
-        json.dump(manifest, fh, ensure_ascii=False, indent=2)
-    logger.info("Run manifest saved: %s", out)
+    try:
+        # Read channels
+        channels = []
+        if args.channels_file and os.path.exists(args.channels_file):
+            with open(args.channels_file, "r", encoding="utf-8") as fh:
+                for ln in fh:
+                    ln = ln.strip()
+                    if ln and not ln.startswith("#"):
+                        channels.append(ln)
+        if args.channels:
+            channels.extend(args.channels)
+        channels = list(dict.fromkeys(channels))
+        if not channels:
+            logger.error("No channels provided")
+            return None
+
+        run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        manifest = {
+            "run_id": run_id,
+            "channels": channels,
+            "limit": args.limit,
+            "incremental": args.incremental,
+            "since": args.since,
+            "until": args.until,
+            "concurrency": args.concurrency,
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "results": {},
+        }
 
-    await client.disconnect()
-    logger.info("Disconnected")
+        # Channels are independent (own day files and seen-id index), so their
+        # RPC waits can overlap; the semaphore keeps Telegram load bounded.
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(ch):
+            async with sem:
+                try:
+                    processed = await scrape_channel(
+                        client, ch, limit=args.limit, incremental=args.incremental,
+                        since=since_date, until=until_date
+                    )
+                    manifest["results"][ch] = {"processed": processed, "status": "ok"}
+                except errors.FloodWaitError as fw:
+                    wait = int(getattr(fw, "seconds", 60)) + 1
+                    logger.warning("FloodWait: sleeping %s s", wait)
+                    await asyncio.sleep(wait)
+                    try:
+                        processed = await scrape_channel(
+                            client, ch, limit=args.limit, incremental=args.incremental,
+                            since=since_date, until=until_date
+                        )
+                        manifest["results"][ch] = {"processed": processed, "status": "ok_after_wait"}
+                    except Exception as e:
+                        logger.exception("Error scraping %s after FloodWait: %s", ch, e)
+                        manifest["results"][ch] = {"processed": 0, "status": f"error:{e}"}
+                except Exception as e:
+                    logger.exception("Error scraping %s: %s", ch, e)
+                    manifest["results"][ch] = {"processed": 0, "status": f"error:{e}"}
+
+        # Per-channel failures are already recorded; never let one abort the others
+        await asyncio.gather(*(bounded(ch) for ch in channels), return_exceptions=True)
+
+        manifest["finished_at"] = datetime.utcnow().isoformat() + "Z"
+        out = MANIFEST_DIR / f"{run_id}.json"
+        with open(out, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, ensure_ascii=False, indent=2)
+        logger.info("Run manifest saved: %s", out)
+        return manifest
+    finally:
+        await client.disconnect()
+        logger.info("Disconnected")
+
+
+def run(channels_file: Optional[str] = "channels.txt", channels=None, limit=None,
+        incremental=False, since: Optional[str] = None, until: Optional[str] = None,
+        concurrency: int = 4):
+    """Scrape in-process (e.g. from Dagster); returns the run manifest."""
+    args = argparse.Namespace(
+        channels_file=channels_file, channels=channels, limit=limit,
+        incremental=incremental, since=since, until=until, concurrency=concurrency,
+    )
+    return asyncio.run(main(args))
 
 
 if __name__ == "__main__":
@@ -286,5 +425,6 @@ if __name__ == "__main__":
     parser.add_argument("--incremental", action="store_true", help="Skip already-saved messages")
     parser.add_argument("--since", type=str, default=None, help="Start date inclusive (YYYY-MM-DD)")
     parser.add_argument("--until", type=str, default=None, help="End date exclusive (YYYY-MM-DD)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Channels scraped at the same time")
     args = parser.parse_args()
     asyncio.run(main(args))
@@ -1,12 +1,16 @@
 import os
 import json
+import asyncio
 from pathlib import Path
 import pandas as pd
 from ultralytics import YOLO
-import psycopg2
-from psycopg2.extras import Json
+import asyncpg
+import orjson
 import re
-import cv2
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import torch
+from PIL import Image
 
 # ---------------------------------------------------------
 # PROJECT ROOT RESOLUTION
@@ -18,31 +22,75 @@ IMG_DIR = PROJECT_ROOT / "data" / "raw" / "images"
 OUT_DIR = PROJECT_ROOT / "data" / "raw" / "yolo_outputs"
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
-# YOLO model
-model = YOLO("yolov8n.pt")
+# YOLO model (moved to the GPU once; FP16 only makes sense there)
+DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
+HALF = DEVICE != "cpu"
+BATCH = int(os.getenv("YOLO_BATCH", "32"))
+MODEL_PATH = os.getenv("YOLO_MODEL", str(Path(__file__).resolve().parent / "yolov8n.pt"))
+# TensorRT engine (fused FP16 kernels) is used on GPU unless YOLO_TRT=0
+USE_TRT = HALF and os.getenv("YOLO_TRT", "1") != "0"
+# Optional dataset yaml of channel images to calibrate an INT8 engine instead of FP16
+INT8_DATA = os.getenv("YOLO_INT8_DATA")
+
+
+def ensure_engine(pt_path: Path) -> Path:
+    """
+    Export the .pt weights to a TensorRT engine next to them, once per build config.
+    Max batch and precision are baked into the engine, so they are part of its name
+    (e.g. yolov8n-b32-fp16.engine) and changing either triggers a fresh export.
+    """
+    precision = "int8" if INT8_DATA else "fp16"
+    engine_path = pt_path.with_name(f"{pt_path.stem}-b{BATCH}-{precision}.engine")
+    if engine_path.exists():
+        return engine_path
+    print(f"Exporting TensorRT engine: {engine_path}")
+    export_args = {"format": "engine", "imgsz": 640, "dynamic": True, "batch": BATCH, "device": DEVICE}
+    if INT8_DATA:
+        export_args.update(int8=True, data=INT8_DATA)
+    else:
+        export_args["half"] = True
+    # ultralytics always writes <stem>.engine; move it to the config-specific name
+    os.replace(YOLO(str(pt_path)).export(**export_args), engine_path)
+    return engine_path
+
+
+@lru_cache(maxsize=1)
+def get_model():
+    """Load the weights once per process so repeated in-process runs reuse them."""
+    pt_path = Path(MODEL_PATH)
+    if USE_TRT and pt_path.suffix == ".pt":
+        try:
+            return YOLO(str(ensure_engine(pt_path)), task="detect")
+        except Exception as e:
+            print(f"[YOLO] TensorRT engine unavailable, using PyTorch weights → {e}")
+    model = YOLO(str(pt_path))
+    if pt_path.suffix == ".pt":
+        model.to(DEVICE)
+    return model
 
 # Postgres connection
 POSTGRES = {
     "host": os.getenv("POSTGRES_HOST", "localhost"),
     "port": int(os.getenv("POSTGRES_PORT", "5432")),
-    "dbname": os.getenv("POSTGRES_DB", "postgres"),
+    "database": os.getenv("POSTGRES_DB", "postgres"),
     "user": os.getenv("POSTGRES_USER", "postgres"),
     "password": os.getenv("POSTGRES_PASSWORD", "root"),
 }
+FLUSH_RECORDS = 5000  # records per COPY into Postgres
+COLUMNS = ["channel", "message_id", "image_path", "detection"]
 
 # ---------------------------------------------------------
 # IMAGE VALIDATION
 # ---------------------------------------------------------
 def is_valid_image(image_path: Path) -> bool:
-    """Return True only if OpenCV can load the image."""
+    """Return True only if PIL can verify the image (reads headers, not pixels)."""
     if not image_path.exists():
         return False
     if image_path.stat().st_size < 500:  # Under 500 bytes = corrupted
         return False
     try:
-        img = cv2.imread(str(image_path))
-        if img is None:
-            return False
+        with Image.open(image_path) as img:
+            img.verify()
     except Exception:
         return False
     return True
@@ -50,43 +98,71 @@ def is_valid_image(image_path: Path) -> bool:
 # ---------------------------------------------------------
 # DB connection
 # ---------------------------------------------------------
-def get_conn():
-    return psycopg2.connect(**POSTGRES)
+async def get_conn():
+    return await asyncpg.connect(**POSTGRES)
 
 # ---------------------------------------------------------
 # Ensure table exists
 # ---------------------------------------------------------
-def ensure_table(conn):
-    with conn.cursor() as cur:
-        cur.execute("""
-        CREATE SCHEMA IF NOT EXISTS raw;
-        CREATE TABLE IF NOT EXISTS raw.image_detections (
-            id SERIAL PRIMARY KEY,
+async def ensure_table(conn):
+    await conn.execute("""
+    CREATE SCHEMA IF NOT EXISTS raw;
+    CREATE TABLE IF NOT EXISTS raw.image_detections (
+        id SERIAL PRIMARY KEY,
+        channel TEXT,
+        message_id INT,
+        image_path TEXT,
+        detection JSONB
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_image_unique
+      ON raw.image_detections(channel, message_id, image_path);
+    """)
+
+# ---------------------------------------------------------
+# Bulk insert (COPY into a temp stage, then dedup on the unique index)
+# ---------------------------------------------------------
+async def insert_records(conn, records):
+    rows = [
+        (rec["channel"], rec["message_id"], rec["image_path"], orjson.dumps(rec["detection"]).decode())
+        for rec in records
+    ]
+    async with conn.transaction():
+        await conn.execute("""
+        CREATE TEMP TABLE stage (
             channel TEXT,
             message_id INT,
             image_path TEXT,
             detection JSONB
-        );
-        CREATE UNIQUE INDEX IF NOT EXISTS idx_image_unique
-          ON raw.image_detections(channel, message_id, image_path);
+        ) ON COMMIT DROP
+        """)
+        await conn.copy_records_to_table("stage", records=rows, columns=COLUMNS)
+        await conn.execute("""
+        INSERT INTO raw.image_detections (channel, message_id, image_path, detection)
+        SELECT channel, message_id, image_path, detection FROM stage
+        ON CONFLICT (channel, message_id, image_path) DO NOTHING
         """)
-        conn.commit()
 
 # ---------------------------------------------------------
 # YOLO inference
 # ---------------------------------------------------------
-def run_yolo_on_image(image_path: Path):
+def run_yolo_on_batch(model, image_paths):
+    """Run one batched predict call; returns a detections list per input path."""
     try:
         results = model.predict(
-            source=str(image_path),
+            source=[str(p) for p in image_paths],
             imgsz=640,
             conf=0.35,
+            batch=len(image_paths),
+            half=HALF,
+            device=DEVICE,
             save=False,
+            stream=True,
             verbose=False
         )
 
-        detections = []
+        batch_detections = []
         for r in results:
+            detections = []
             for box in r.boxes:
                 detections.append({
                     "class_id": int(box.cls.cpu().numpy()[0]),
@@ -94,34 +170,28 @@ def run_yolo_on_image(image_path: Path):
                     "xyxy": [float(x) for x in box.xyxy.cpu().numpy()[0]],
                     "class_name": model.names[int(box.cls)],
                 })
-        return detections
+            batch_detections.append(detections)
+        return batch_detections
 
     except Exception as e:
-        print(f"[YOLO ERROR] Cannot process image: {image_path} → {e}")
-        return []
+        if len(image_paths) == 1:
+            print(f"[YOLO ERROR] Cannot process image: {image_paths[0]} → {e}")
+            return [[]]
+        # One bad image fails the whole call; retry individually so only it is dropped
+        print(f"[YOLO ERROR] Batch starting at {image_paths[0]} failed, retrying per image → {e}")
+        return [run_yolo_on_batch(model, [p])[0] for p in image_paths]
 
 # ---------------------------------------------------------
 # MAIN PIPELINE
 # ---------------------------------------------------------
-def main():
-    all_records = []
-    conn = get_conn()
-    ensure_table(conn)
-
-    for channel_dir in IMG_DIR.iterdir():
-        if not channel_dir.is_dir():
-            continue
-
-        print(f"\nProcessing channel: {channel_dir.name}")
-
-        for img_path in channel_dir.glob("*"):
+async def produce(model, queue: asyncio.Queue):
+    """Run YOLO batches off the event loop and queue each record as it is ready."""
+    loop = asyncio.get_running_loop()
 
-            # Skip invalid or corrupted images
-            if not is_valid_image(img_path):
-                print(f"Skipping invalid image: {img_path}")
-                continue
-
-            detections = run_yolo_on_image(img_path)
+    async def detect(channel_name, chunk):
+        # predict() releases the GIL, so inserts and validation proceed while the GPU works
+        batch = await loop.run_in_executor(None, run_yolo_on_batch, model, chunk)
+        for img_path, detections in zip(chunk, batch):
             if not detections:
                 continue
 
@@ -129,34 +199,84 @@ def main():
             m = re.search(r"(\d+)", img_path.stem)
             message_id = int(m.group(1)) if m else None
 
-            record = {
-                "channel": channel_dir.name,
+            await queue.put({
+                "channel": channel_name,
                 "message_id": message_id,
                 "image_path": str(img_path),
                 "detection": detections
-            }
-            all_records.append(record)
+            })
+
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as validator:
+            for channel_dir in IMG_DIR.iterdir():
+                if not channel_dir.is_dir():
+                    continue
+
+                print(f"\nProcessing channel: {channel_dir.name}")
+
+                # All checks are queued up front and finish in the background
+                # while earlier batches are on the GPU.
+                paths = list(channel_dir.glob("*"))
+                checks = [asyncio.wrap_future(validator.submit(is_valid_image, p)) for p in paths]
+
+                chunk = []
+                for img_path, check in zip(paths, checks):
+
+                    # Skip invalid or corrupted images
+                    if not await check:
+                        print(f"Skipping invalid image: {img_path}")
+                        continue
+                    chunk.append(img_path)
+                    if len(chunk) == BATCH:
+                        await detect(channel_dir.name, chunk)
+                        chunk = []
+                if chunk:
+                    await detect(channel_dir.name, chunk)
+    finally:
+        await queue.put(None)
+
+
+async def consume(conn, queue: asyncio.Queue, all_records):
+    """Drain queued records into Postgres every FLUSH_RECORDS."""
+    pending = []
+    while True:
+        rec = await queue.get()
+        if rec is None:
+            break
+        all_records.append(rec)
+        pending.append(rec)
+        if len(pending) >= FLUSH_RECORDS:
+            await insert_records(conn, pending)
+            pending = []
+    if pending:
+        await insert_records(conn, pending)
+
+
+async def run_async(model):
+    all_records = []
+    conn = await get_conn()
+    try:
+        await ensure_table(conn)
+        queue = asyncio.Queue()
+        await asyncio.gather(produce(model, queue), consume(conn, queue, all_records))
+    finally:
+        await conn.close()
 
     # Save JSON output
     with open(OUT_DIR / "all_detections.json", "w", encoding="utf-8") as f:
         json.dump(all_records, f, ensure_ascii=False, indent=2)
 
-    # Insert into Postgres
-    with conn.cursor() as cur:
-        for rec in all_records:
-            cur.execute("""
-                INSERT INTO raw.image_detections (channel, message_id, image_path, detection)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (channel, message_id, image_path) DO NOTHING;
-            """, (rec["channel"], rec["message_id"], rec["image_path"], Json(rec["detection"])))
-        conn.commit()
-
     print(f"\nSaved {len(all_records)} YOLO detections.")
-    conn.close()
+    return len(all_records)
+
+
+def run(model=None):
+    """Detect objects in all downloaded images; returns the number of records saved."""
+    return asyncio.run(run_async(model or get_model()))
 
 
 # ---------------------------------------------------------
 # ENTRY POINT
 # ---------------------------------------------------------
 if __name__ == "__main__":
-    main()
+    run()
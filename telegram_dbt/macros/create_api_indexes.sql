@@ -0,0 +1,41 @@
+{#
+  Btree indexes matching the API's filter / ORDER BY columns, so those
+  queries become index range scans instead of seq scan + sort.
+  Each group is skipped when its table does not exist (see index_if_exists).
+#}
+{% macro create_api_indexes() %}
+  {% call(rel) index_if_exists('analytics', 'fct_messages') %}
+    create index if not exists idx_fct_messages_channel_date
+      on {{ rel }} (channel, message_date desc);
+
+    -- /api/messages-with-objects keyset: dated segment, then the NULL-date tail
+    create index if not exists idx_fct_messages_keyset
+      on {{ rel }} (message_date desc, channel desc, message_id desc)
+      where message_date is not null;
+
+    create index if not exists idx_fct_messages_keyset_undated
+      on {{ rel }} (channel desc, message_id desc)
+      where message_date is null;
+  {% endcall %}
+
+  {% call(rel) index_if_exists('analytics', 'fct_image_detections') %}
+    create index if not exists idx_fct_image_detections_object
+      on {{ rel }} (object) include (confidence);
+
+    create index if not exists idx_fct_image_detections_confidence
+      on {{ rel }} (confidence desc);
+
+    create index if not exists idx_fct_image_detections_message
+      on {{ rel }} (channel, message_id);
+  {% endcall %}
+
+  {% call(rel) index_if_exists(target.schema, 'agg_top_objects') %}
+    create index if not exists idx_agg_top_objects_mentions
+      on {{ rel }} (mentions desc);
+  {% endcall %}
+
+  {% call(rel) index_if_exists(target.schema, 'agg_channel_daily') %}
+    create index if not exists idx_agg_channel_daily_channel_day
+      on {{ rel }} (channel, day);
+  {% endcall %}
+{% endmacro %}
@@ -0,0 +1,18 @@
+{#
+  Trigram indexes backing the API's substring search.
+  The fct tables are read as sources, so each index is created from the
+  on-run-end hook once its table exists, and skipped otherwise.
+#}
+{% macro create_search_indexes() %}
+  {% call(rel) index_if_exists('analytics', 'fct_messages') %}
+    create extension if not exists pg_trgm;
+    create index if not exists idx_fct_messages_text_trgm
+      on {{ rel }} using gin (lower(message_text) gin_trgm_ops);
+  {% endcall %}
+
+  {% call(rel) index_if_exists('analytics', 'fct_image_detections') %}
+    create extension if not exists pg_trgm;
+    create index if not exists idx_fct_image_detections_object_trgm
+      on {{ rel }} using gin (lower(object) gin_trgm_ops);
+  {% endcall %}
+{% endmacro %}
@@ -0,0 +1,19 @@
+{#
+  Run the caller's DDL against schema.identifier only if that relation exists.
+  Used by the on-run-end index hooks: the fct tables are published outside this
+  project, so a fresh database may not have them yet.
+
+    {% call(rel) index_if_exists('analytics', 'fct_messages') %}
+      create index if not exists ... on {{ rel }} (...)
+    {% endcall %}
+#}
+{% macro index_if_exists(schema, identifier) %}
+  {% if execute %}
+    {% set relation = adapter.get_relation(database=target.database, schema=schema, identifier=identifier) %}
+    {% if relation is not none %}
+      {% do run_query(caller(relation)) %}
+    {% else %}
+      {{ log("Skipping indexes on " ~ schema ~ "." ~ identifier ~ ": relation does not exist", info=True) }}
+    {% endif %}
+  {% endif %}
+{% endmacro %}
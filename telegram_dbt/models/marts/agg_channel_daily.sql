@@ -0,0 +1,21 @@
+{#
+  Daily message counts per channel, served by /api/channel-activity.
+  Incremental runs only recompute the most recent days (new messages land
+  there); use --full-refresh after backfilling older dates.
+#}
+{{ config(
+    materialized='incremental',
+    unique_key=['channel', 'day'],
+    incremental_strategy='delete+insert'
+) }}
+
+select
+    channel,
+    date_trunc('day', message_date)::date as day,
+    count(*) as messages
+from {{ source('analytics', 'fct_messages') }}
+where message_date is not null
+{% if is_incremental() %}
+  and message_date >= (select max(day) from {{ this }}) - interval '{{ var("agg_lookback_days", 3) }} days'
+{% endif %}
+group by 1, 2
@@ -0,0 +1,14 @@
+{#
+  Detection counts per object, served by /api/top-objects.
+  fct_image_detections has no load timestamp to increment on, so this is
+  rebuilt each run; that is one aggregation per pipeline run instead of
+  one per HTTP request.
+#}
+{{ config(materialized='table') }}
+
+select
+    object,
+    count(*) as mentions
+from {{ source('analytics', 'fct_image_detections') }}
+where object is not null
+group by object